@@ -0,0 +1,327 @@
+import os
+import math
+import time
+import logging
+import inspect
+import threading
+import contextvars
+from functools import wraps
+from flask import jsonify
+
+logger = logging.getLogger("admission")
+
+# Per-dependency admission settings. Limits are per worker process;
+# gunicorn.conf.py sizes gthread workers with more threads than all the
+# concurrent and queued slots combined, and the spare threads are what keep
+# static pages and index.html responsive while an upstream is slow.
+# calls_per_request is the most upstream calls one admitted request makes;
+# gunicorn.conf.py uses it to give such a request time to finish on shutdown.
+ADMISSION_CONFIG = {
+    'stripe': {
+        'max_concurrent': int(os.getenv('STRIPE_MAX_CONCURRENT', 4)),
+        'max_queue': int(os.getenv('STRIPE_MAX_QUEUE', 8)),
+        'queue_timeout': float(os.getenv('STRIPE_QUEUE_TIMEOUT', 2.0)),
+        'failure_threshold': int(os.getenv('STRIPE_FAILURE_THRESHOLD', 5)),
+        'reset_timeout': float(os.getenv('STRIPE_RESET_TIMEOUT', 30.0)),
+        'timeout': int(os.getenv('STRIPE_TIMEOUT', 20)),
+        # Customer.list, Customer.create and checkout.Session.create
+        'calls_per_request': 3
+    },
+    'cryptlex': {
+        'max_concurrent': int(os.getenv('CRYPTLEX_MAX_CONCURRENT', 4)),
+        'max_queue': int(os.getenv('CRYPTLEX_MAX_QUEUE', 8)),
+        'queue_timeout': float(os.getenv('CRYPTLEX_QUEUE_TIMEOUT', 2.0)),
+        'failure_threshold': int(os.getenv('CRYPTLEX_FAILURE_THRESHOLD', 5)),
+        'reset_timeout': float(os.getenv('CRYPTLEX_RESET_TIMEOUT', 30.0)),
+        'timeout': int(os.getenv('CRYPTLEX_TIMEOUT', 10)),
+        'calls_per_request': 1
+    },
+    # Contact form and newsletter mail; a hung mail server must not hold
+    # every request thread
+    'smtp': {
+        'max_concurrent': int(os.getenv('SMTP_MAX_CONCURRENT', 2)),
+        'max_queue': int(os.getenv('SMTP_MAX_QUEUE', 4)),
+        'queue_timeout': float(os.getenv('SMTP_QUEUE_TIMEOUT', 2.0)),
+        'failure_threshold': int(os.getenv('SMTP_FAILURE_THRESHOLD', 3)),
+        'reset_timeout': float(os.getenv('SMTP_RESET_TIMEOUT', 60.0)),
+        'timeout': int(os.getenv('SMTP_TIMEOUT', 15)),
+        # Newsletter confirmation and admin notification
+        'calls_per_request': 2
+    }
+}
+
+# Outcome of the upstream calls made by the admitted request being served
+_request_outcome = contextvars.ContextVar('admission_outcome', default=None)
+
+# Retry-After sent when a request is shed because the bulkhead is full
+SATURATED_RETRY_AFTER = int(os.getenv('SATURATED_RETRY_AFTER', 1))
+
+
+class Bulkhead:
+    """
+    Concurrency limit with a bounded wait queue for one dependency
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """
+        Take a slot, waiting up to queue_timeout if the queue has room
+        Returns False if the request should be shed
+        """
+        with self._cond:
+            if self.in_flight >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    return False
+
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while self.in_flight >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive upstream errors and lets a
+    single probe request through once reset_timeout has elapsed
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                logger.info(f"Circuit for {self.name} half-open, allowing a probe request")
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """Free the half-open probe slot if the request never reached the upstream"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                    logger.error(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        with self._lock:
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, int(math.ceil(remaining)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
+
+
+class Dependency:
+    """
+    Bulkhead and circuit breaker guarding one upstream service
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.timeout = config['timeout']
+        self.bulkhead = Bulkhead(name, config['max_concurrent'], config['max_queue'], config['queue_timeout'])
+        self.breaker = CircuitBreaker(name, config['failure_threshold'], config['reset_timeout'])
+
+    def admit(self):
+        """
+        Returns None if the request may proceed, otherwise a 503 response
+        """
+        if not self.breaker.allow():
+            logger.warning(f"Shedding request: circuit for {self.name} is open")
+            return _unavailable(self.name, self.breaker.retry_after())
+
+        if not self.bulkhead.acquire():
+            self.breaker.release_probe()
+            logger.warning(f"Shedding request: {self.name} bulkhead saturated")
+            return _unavailable(self.name, SATURATED_RETRY_AFTER)
+
+        return None
+
+    def leave(self, outcome):
+        """
+        Release the slot and report one breaker outcome for the whole request,
+        so a successful call cannot mask a later failed one in the same request
+        """
+        self.bulkhead.release()
+        if outcome['failed']:
+            self.breaker.record_failure()
+        elif outcome['succeeded']:
+            self.breaker.record_success()
+        else:
+            self.breaker.release_probe()
+
+    def stats(self):
+        return {
+            'bulkhead': self.bulkhead.stats(),
+            'circuit': self.breaker.stats()
+        }
+
+
+DEPENDENCIES = {name: Dependency(name, config) for name, config in ADMISSION_CONFIG.items()}
+
+
+def _unavailable(name, retry_after):
+    response = jsonify({"error": f"The {name} service is temporarily unavailable. Please try again shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def shed_load(name):
+    """
+    Route decorator that admits the request through the named dependency's
+    circuit breaker and bulkhead, returning 503 with Retry-After when it
+    cannot be served
+    """
+    dependency = DEPENDENCIES[name]
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                rejection = dependency.admit()
+                if rejection is not None:
+                    return rejection
+                outcome = {'name': name, 'failed': False, 'succeeded': False}
+                token = _request_outcome.set(outcome)
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    _request_outcome.reset(token)
+                    dependency.leave(outcome)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            rejection = dependency.admit()
+            if rejection is not None:
+                return rejection
+            outcome = {'name': name, 'failed': False, 'succeeded': False}
+            token = _request_outcome.set(outcome)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _request_outcome.reset(token)
+                dependency.leave(outcome)
+        return wrapper
+
+    return decorator
+
+
+class upstream_call:
+    """
+    Context manager that reports the outcome of an outbound call. Inside a
+    shed_load route the outcome is folded into the request's single breaker
+    report; elsewhere it goes to the breaker directly. Exceptions count as
+    failures unless listed in ignore; call fail() for error responses that
+    do not raise.
+    """
+
+    def __init__(self, name, ignore=()):
+        self.dependency = DEPENDENCIES[name]
+        self.ignore = ignore
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not issubclass(exc_type, self.ignore):
+            self.failed = True
+        outcome = _request_outcome.get()
+        if outcome is not None and outcome['name'] == self.dependency.name:
+            outcome['failed' if self.failed else 'succeeded'] = True
+        elif self.failed:
+            self.dependency.breaker.record_failure()
+        else:
+            self.dependency.breaker.record_success()
+        return False
+
+
+def stats():
+    """
+    Queue depth, rejection counts and circuit state for every dependency
+    """
+    return {name: dependency.stats() for name, dependency in DEPENDENCIES.items()}
@@ -0,0 +1,141 @@
+# Compare gunicorn worker models under upstream-bound load.
+#
+#   python benchmark.py [sync gthread gevent]
+#
+# Starts a fake Cryptlex API with fixed latency, then for each worker model
+# runs gunicorn with gunicorn.conf.py and drives /check-active-license and
+# / concurrently. Results are printed as a table; see gunicorn.conf.py.
+
+import os
+import sys
+import time
+import json
+import socket
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+BENCH_CONFIG = {
+    'upstream_delay': float(os.getenv('BENCH_UPSTREAM_DELAY', 0.2)),
+    'license_clients': int(os.getenv('BENCH_LICENSE_CLIENTS', 32)),
+    'index_clients': int(os.getenv('BENCH_INDEX_CLIENTS', 4)),
+    'duration': float(os.getenv('BENCH_DURATION', 15)),
+    'port': int(os.getenv('BENCH_PORT', 4343))
+}
+
+
+class FakeCryptlexHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(BENCH_CONFIG['upstream_delay'])
+        body = json.dumps([]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_upstream():
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), FakeCryptlexHandler)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{upstream.server_address[1]}"
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def drive(url, method, payload, deadline, latencies, errors):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, json=payload, timeout=30)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            else:
+                latencies.append(time.perf_counter() - started)
+        except requests.RequestException as e:
+            errors.append(type(e).__name__)
+
+
+def run(worker_class, upstream_url):
+    port = BENCH_CONFIG['port']
+    env = dict(
+        os.environ,
+        WORKER_CLASS=worker_class,
+        PORT=str(port),
+        CRYPTLEX_API_URL=upstream_url,
+        # Recycling every 1000 requests would restart workers mid-run
+        MAX_REQUESTS='0',
+        # requests reads a 103 Early Hints response as the final one
+        PRELOAD_EARLY_HINTS='0',
+        LOG_LEVEL='warning'
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        wait_for_port(port)
+        base = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + BENCH_CONFIG['duration']
+        license_latencies, index_latencies, errors = [], [], []
+        clients = [
+            threading.Thread(target=drive, args=(f"{base}/check-active-license", "POST",
+                                                 {"userEmail": "bench@example.com"}, deadline, license_latencies, errors))
+            for _ in range(BENCH_CONFIG['license_clients'])
+        ] + [
+            threading.Thread(target=drive, args=(f"{base}/", "GET", None, deadline, index_latencies, errors))
+            for _ in range(BENCH_CONFIG['index_clients'])
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'worker': worker_class,
+        'license_rps': len(license_latencies) / BENCH_CONFIG['duration'],
+        'license_p50': percentile(license_latencies, 0.5),
+        'license_p99': percentile(license_latencies, 0.99),
+        'index_p50': percentile(index_latencies, 0.5),
+        'index_p99': percentile(index_latencies, 0.99),
+        # 503s are admission control shedding load, not failures
+        'shed': errors.count(503),
+        'errors': len(errors) - errors.count(503)
+    }
+
+
+if __name__ == "__main__":
+    upstream_url = start_upstream()
+    print(f"{'worker':<9} {'license req/s':>14} {'license p50/p99 ms':>20} {'index p50/p99 ms':>18} "
+          f"{'shed':>6} {'errors':>7}")
+    for worker_class in sys.argv[1:] or ['sync', 'gthread', 'gevent']:
+        result = run(worker_class, upstream_url)
+        print(f"{result['worker']:<9} {result['license_rps']:>14.1f} "
+              f"{result['license_p50']:>9.0f} / {result['license_p99']:<8.0f} "
+              f"{result['index_p50']:>7.0f} / {result['index_p99']:<8.0f} {result['shed']:>6} {result['errors']:>7}")
@@ -6,11 +6,16 @@ from email.mime.multipart import MIMEMultipart
 import re
 from dotenv import load_dotenv
 import urllib.parse
+import hashlib
+import sqlite3
+import time
+import tracing
+from admission import ADMISSION_CONFIG, upstream_call
 
 # Configure logging first
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s',
     handlers=[
         logging.FileHandler("contact_form.log"),
         logging.StreamHandler()
@@ -55,6 +60,15 @@ EMAIL_CONFIG = {
         'name_max_length': 100,
         'message_max_length': 2000,
         'phone_pattern': r'^[0-9+\-\(\) ]{6,20}$'
+    },
+    'dedupe': {
+        # Identical submissions within this window are not emailed again
+        'window_seconds': int(os.getenv('CONTACT_DEDUPE_WINDOW', 3600)),
+        'max_entries': int(os.getenv('CONTACT_DEDUPE_MAX_ENTRIES', 10000)),
+        # A send still pending after this long is assumed lost (e.g. the worker died)
+        'pending_timeout': int(os.getenv('CONTACT_DEDUPE_PENDING_TIMEOUT', 120)),
+        # SQLite file shared by all workers on this host
+        'db_path': os.getenv('CONTACT_DEDUPE_DB', 'contact_dedupe.sqlite3')
     }
 }
 
@@ -86,6 +100,123 @@ def validate_form_data(name, email, phone, message):
     
     return True, ""
 
+def submission_key(name, email, message):
+    """
+    Content hash of a submission, normalized so trivial differences in case
+    and whitespace still count as the same message
+    """
+    normalized = [
+        ' '.join(name.split()).lower(),
+        email.strip().lower(),
+        ' '.join(message.split())
+    ]
+    return hashlib.sha256('\0'.join(normalized).encode('utf-8')).hexdigest()
+
+def _dedupe_connection():
+    conn = sqlite3.connect(EMAIL_CONFIG['dedupe']['db_path'], timeout=5, isolation_level=None)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS submissions ("
+        "key TEXT PRIMARY KEY, status TEXT NOT NULL DEFAULT 'sent', last_seen REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS submissions_last_seen ON submissions (last_seen)")
+    conn.execute("CREATE TABLE IF NOT EXISTS dedupe_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    return conn
+
+def claim_submission(key):
+    """
+    Record a submission key as pending before sending
+    Returns 'claimed' if this request should send the message, 'pending' if
+    an identical submission is still being sent, or 'sent' if it was already
+    sent within the dedupe window
+    """
+    settings = EMAIL_CONFIG['dedupe']
+    now = time.time()
+    try:
+        conn = _dedupe_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM submissions WHERE last_seen < ?", (now - settings['window_seconds'],))
+            conn.execute(
+                "DELETE FROM submissions WHERE status = 'pending' AND last_seen < ?",
+                (now - settings['pending_timeout'],)
+            )
+            row = conn.execute("SELECT status FROM submissions WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                result = 'claimed'
+                conn.execute(
+                    "INSERT INTO submissions (key, status, last_seen) VALUES (?, 'pending', ?)", (key, now)
+                )
+            else:
+                result = row[0]
+                if result == 'sent':
+                    # Refresh on every hit so the oldest-seen entries are evicted first
+                    conn.execute("UPDATE submissions SET last_seen = ? WHERE key = ?", (now, key))
+
+            conn.execute(
+                "DELETE FROM submissions WHERE key IN ("
+                "SELECT key FROM submissions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (settings['max_entries'],)
+            )
+            counter = {'claimed': 'accepted', 'pending': 'duplicate_while_pending', 'sent': 'suppressed'}[result]
+            conn.execute(
+                "INSERT INTO dedupe_stats (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (counter,)
+            )
+            conn.execute("COMMIT")
+            return result
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        # Fail open: a broken dedupe store must not block real messages
+        logger.error(f"Submission dedupe unavailable: {str(e)}")
+        return 'claimed'
+
+def mark_submission_sent(key):
+    """
+    Mark a claimed submission as sent so later duplicates are suppressed
+    """
+    try:
+        conn = _dedupe_connection()
+        try:
+            conn.execute("UPDATE submissions SET status = 'sent', last_seen = ? WHERE key = ?", (time.time(), key))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to mark submission as sent: {str(e)}")
+
+def release_submission(key):
+    """
+    Forget a claimed submission so the user can retry after a failed send
+    """
+    try:
+        conn = _dedupe_connection()
+        try:
+            conn.execute("DELETE FROM submissions WHERE key = ?", (key,))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to release submission key: {str(e)}")
+
+def get_dedupe_stats():
+    """
+    Cumulative counts of accepted submissions, duplicates that arrived while
+    the first copy was still being sent, and suppressed duplicates of sent
+    messages, across all workers
+    """
+    stats = {'accepted': 0, 'duplicate_while_pending': 0, 'suppressed': 0, 'tracked': 0}
+    try:
+        conn = _dedupe_connection()
+        try:
+            stats.update(dict(conn.execute("SELECT name, value FROM dedupe_stats").fetchall()))
+            stats['tracked'] = conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to read dedupe stats: {str(e)}")
+    return stats
+
 def send_email(name, email, phone, message):
     """
     Send email using SMTP
@@ -174,25 +305,27 @@ def send_email(name, email, phone, message):
     msg.attach(part2)
     
     try:
-        # Connect to SMTP server
-        logger.info(f"Connecting to SMTP server {smtp_settings['host']}:{smtp_settings['port']}...")
-        server = smtplib.SMTP(smtp_settings['host'], smtp_settings['port'])
-        server.ehlo()
-        
-        # Use TLS if specified
-        if smtp_settings['encryption'] == 'tls':
-            logger.info("Starting TLS encryption...")
-            server.starttls()
+        with tracing.span("smtp.send", **{"smtp.host": smtp_settings['host']}), upstream_call("smtp"):
+            # Connect to SMTP server
+            logger.info(f"Connecting to SMTP server {smtp_settings['host']}:{smtp_settings['port']}...")
+            server = smtplib.SMTP(smtp_settings['host'], smtp_settings['port'],
+                                  timeout=ADMISSION_CONFIG['smtp']['timeout'])
             server.ehlo()
-        
-        # Login to SMTP server
-        logger.info(f"Logging in with username: {smtp_settings['username']}...")
-        server.login(smtp_settings['username'], smtp_settings['password'])
-        
-        # Send email
-        logger.info(f"Sending email from {smtp_settings['from_email']} to {recipient}...")
-        server.sendmail(smtp_settings['from_email'], recipient, msg.as_string())
-        server.quit()
+            
+            # Use TLS if specified
+            if smtp_settings['encryption'] == 'tls':
+                logger.info("Starting TLS encryption...")
+                server.starttls()
+                server.ehlo()
+            
+            # Login to SMTP server
+            logger.info(f"Logging in with username: {smtp_settings['username']}...")
+            server.login(smtp_settings['username'], smtp_settings['password'])
+            
+            # Send email
+            logger.info(f"Sending email from {smtp_settings['from_email']} to {recipient}...")
+            server.sendmail(smtp_settings['from_email'], recipient, msg.as_string())
+            server.quit()
         
         logger.info(f"Email sent successfully to {recipient}")
         return True, ""
@@ -357,15 +490,31 @@ def process_contact_form(request):
             logger.info(f"Redirecting to: {error_url}")
             return redirect(error_url)
         
+        # Skip resubmissions and replays of a message we already sent
+        key = submission_key(name, email, message)
+        claim = claim_submission(key)
+        if claim == 'sent':
+            logger.info(f"Duplicate submission suppressed. Redirecting to: {EMAIL_CONFIG['form']['thank_you_page']}")
+            return redirect(EMAIL_CONFIG['form']['thank_you_page'])
+        if claim == 'pending':
+            # The first copy may still fail, so don't claim it was sent
+            logger.info("Duplicate of a submission still being sent")
+            encoded_error = urllib.parse.quote("Your message is already being sent. Please wait a moment before trying again.")
+            error_url = f"{EMAIL_CONFIG['form']['error_redirect']}?error={encoded_error}"
+            logger.info(f"Redirecting to: {error_url}")
+            return redirect(error_url)
+        
         # Send email
         logger.info("Form validation successful. Attempting to send email...")
         success, error = send_email(name, email, phone, message)
         
         if success:
+            mark_submission_sent(key)
             # Redirect to thank you page
             logger.info(f"Email sent successfully. Redirecting to: {EMAIL_CONFIG['form']['thank_you_page']}")
             return redirect(EMAIL_CONFIG['form']['thank_you_page'])
         else:
+            release_submission(key)
             # Redirect back to form with error - properly encode the error message
             logger.warning(f"Failed to send email: {error}")
             encoded_error = urllib.parse.quote(error)
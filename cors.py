@@ -0,0 +1,82 @@
+import os
+import logging
+
+logger = logging.getLogger("cors")
+
+# CORS applies only to the JSON/form API; static assets and pages are same-origin
+CORS_CONFIG = {
+    # Comma-separated list of allowed origins, or * for any. Unset also allows
+    # any origin, with a startup warning
+    'origins_set': 'CORS_ORIGINS' in os.environ,
+    'origins': [origin.strip() for origin in os.getenv('CORS_ORIGINS', '*').split(',') if origin.strip()],
+    'methods': ['GET', 'POST', 'OPTIONS'],
+    'allow_headers': ['Content-Type', 'Authorization', 'X-Request-ID'],
+    'expose_headers': ['X-Request-ID', 'Retry-After'],
+    # Browsers cap this (Chrome at 2 hours) but will cache the preflight up to it
+    'max_age': int(os.getenv('CORS_MAX_AGE', 86400)),
+    'paths': {
+        '/get-stripe-key',
+        '/get-product-ids',
+        '/check-active-license',
+        '/create-checkout-session',
+        '/contact/submit',
+        '/newsletter/subscribe',
+        '/docs/search'
+    }
+}
+
+
+class CORSMiddleware:
+    """
+    WSGI middleware that answers preflights for API paths from precomputed
+    headers, before Flask routing or any request hooks run, and adds CORS
+    headers to actual API responses. Other paths pass through untouched.
+    """
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.paths = frozenset(config['paths'])
+        self.any_origin = '*' in config['origins']
+        self.origins = frozenset(config['origins'])
+        self.preflight_headers = [
+            ('Access-Control-Allow-Methods', ', '.join(config['methods'])),
+            ('Access-Control-Allow-Headers', ', '.join(config['allow_headers'])),
+            ('Access-Control-Max-Age', str(config['max_age'])),
+            ('Content-Length', '0')
+        ]
+        self.expose_header = ('Access-Control-Expose-Headers', ', '.join(config['expose_headers']))
+        if self.any_origin and not config['origins_set']:
+            logger.warning("CORS_ORIGINS is not set, so API paths accept requests from any origin; "
+                           "set it to the allowed origins, or to * to allow any explicitly")
+        else:
+            logger.info(f"CORS origins for API paths: {', '.join(sorted(self.origins))}")
+
+    def origin_headers(self, origin):
+        if self.any_origin:
+            return [('Access-Control-Allow-Origin', '*')]
+        if origin in self.origins:
+            return [('Access-Control-Allow-Origin', origin)]
+        return None
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') not in self.paths:
+            return self.wsgi_app(environ, start_response)
+
+        origin = environ.get('HTTP_ORIGIN')
+        allowed = self.origin_headers(origin) if origin else None
+        # With an origin allow-list the response depends on Origin, so caches must key on it
+        vary = [] if self.any_origin else [('Vary', 'Origin')]
+
+        if origin and environ['REQUEST_METHOD'] == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            headers = allowed + self.preflight_headers if allowed else [('Content-Length', '0')]
+            start_response('204 No Content', headers + vary)
+            return []
+
+        extra = (allowed + [self.expose_header] if allowed else []) + vary
+        if not extra:
+            return self.wsgi_app(environ, start_response)
+
+        def cors_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + extra, exc_info)
+
+        return self.wsgi_app(environ, cors_start_response)
@@ -0,0 +1,402 @@
+import os
+import re
+import json
+import math
+import html
+import bisect
+import hashlib
+import logging
+import threading
+import time
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from html.parser import HTMLParser
+
+logger = logging.getLogger("doc_search")
+
+SEARCH_CONFIG = {
+    'source': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'doc.html'),
+    # Prebuilt index written by `python doc_search.py`; rebuilt on startup if stale
+    'index_path': os.getenv('DOC_SEARCH_INDEX', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'doc_search_index.json')),
+    # How often a search may stat doc.html to pick up edits
+    'check_interval': float(os.getenv('DOC_SEARCH_CHECK_INTERVAL', 5)),
+    # Section container and the heading level that starts a new section
+    'root_id': 'documentation',
+    'section_tag': 'h2',
+    'title_boost': 3,
+    'max_results': 10,
+    'snippet_chars': 160
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with'
+}
+
+# Longest suffixes first; a light stemmer is enough for a single doc page
+SUFFIXES = ['ational', 'ization', 'ations', 'ation', 'ings', 'ing', 'edly', 'ed', 'ies', 'ness', 'ment', 'ers', 'er', 'ly', 's']
+
+
+def stem(word):
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+            break
+    # Fold a trailing e so value/values/valued share a stem
+    if word.endswith('e') and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """
+    Yield (stem, start, end) for each indexable word in text
+    """
+    for match in WORD_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word in STOP_WORDS:
+            continue
+        yield stem(word), match.start(), match.end()
+
+
+class DocSectionParser(HTMLParser):
+    """
+    Split the documentation container into sections at each heading with an id
+    """
+
+    def __init__(self, root_id, section_tag):
+        super().__init__()
+        self.root_id = root_id
+        self.section_tag = section_tag
+        self.sections = []
+        self._depth = 0
+        self._root_depth = None
+        self._skip = 0
+        self._in_heading = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in ('script', 'style'):
+            self._skip += 1
+        if tag in ('br', 'hr', 'img', 'input', 'meta', 'link', 'source', 'wbr'):
+            return
+        self._depth += 1
+        if self._root_depth is None:
+            if attrs.get('id') == self.root_id:
+                self._root_depth = self._depth
+                self.sections.append({'anchor': self.root_id, 'title': 'Documentation', 'parts': []})
+            return
+        if tag == self.section_tag and attrs.get('id'):
+            self.sections.append({'anchor': attrs['id'], 'title': '', 'parts': []})
+            self._in_heading = True
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        if tag in ('br', 'hr', 'img', 'input', 'meta', 'link', 'source', 'wbr'):
+            return
+        if tag == self.section_tag:
+            self._in_heading = False
+        if self._root_depth is not None and self._depth == self._root_depth:
+            self._root_depth = -1
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if self._skip or self._root_depth in (None, -1) or not self.sections:
+            return
+        section = self.sections[-1]
+        if self._in_heading:
+            section['title'] += data
+        else:
+            section['parts'].append(data)
+
+
+def parse_sections(source_html):
+    parser = DocSectionParser(SEARCH_CONFIG['root_id'], SEARCH_CONFIG['section_tag'])
+    parser.feed(source_html)
+    sections = []
+    for section in parser.sections:
+        title = ' '.join(section['title'].split())
+        text = ' '.join(' '.join(section['parts']).split())
+        sections.append({
+            'anchor': section['anchor'],
+            'title': title or section['anchor'],
+            'text': text,
+            'hash': hashlib.sha1(f"{title}\0{text}".encode('utf-8')).hexdigest()
+        })
+    return sections
+
+
+def section_terms(section):
+    """
+    Term frequencies for one section, with the title weighted up
+    """
+    terms = Counter(term for term, _, _ in tokenize(section['text']))
+    for term, _, _ in tokenize(section['title']):
+        terms[term] += SEARCH_CONFIG['title_boost']
+    return dict(terms)
+
+
+def build_sections(source_html, previous=None):
+    """
+    Parse doc.html into indexed sections, reusing the term counts of any
+    section whose content hash is unchanged since the previous build
+    """
+    cached = {section['hash']: section['terms'] for section in (previous or [])}
+    sections = parse_sections(source_html)
+    reused = 0
+    for section in sections:
+        if section['hash'] in cached:
+            section['terms'] = cached[section['hash']]
+            reused += 1
+        else:
+            section['terms'] = section_terms(section)
+    logger.info(f"Indexed {len(sections)} doc sections ({reused} unchanged)")
+    return sections
+
+
+class DocSearchIndex:
+    """
+    Memory-resident inverted index over the sections of doc.html
+    """
+
+    def __init__(self, sections, source_mtime, previous=None):
+        self.sections = sections
+        self.source_mtime = source_mtime
+        self.version = hashlib.sha1(''.join(s['hash'] for s in sections).encode()).hexdigest()[:16]
+        self.postings = {}
+        self.lengths = []
+        for doc_id, section in enumerate(sections):
+            self.lengths.append(sum(section['terms'].values()))
+            for term, tf in section['terms'].items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        self.vocabulary = sorted(self.postings)
+        # Word offsets for snippets. Not persisted; sections unchanged since
+        # the previous in-memory index reuse its offsets instead of re-tokenizing
+        cached = previous.tokens_by_hash if previous else {}
+        self.tokens_by_hash = {}
+        for section in sections:
+            key = section['hash']
+            if key not in self.tokens_by_hash:
+                self.tokens_by_hash[key] = cached[key] if key in cached else list(tokenize(section['text']))
+        self.tokens = [self.tokens_by_hash[section['hash']] for section in sections]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+
+    def expand_prefix(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\uffff')
+        return self.vocabulary[start:end]
+
+    def search(self, query, limit):
+        """
+        BM25-ranked sections; the last query word also matches as a prefix
+        """
+        words = [term for term, _, _ in tokenize(query)]
+        raw = [word for word in WORD_PATTERN.findall(query.lower()) if word not in STOP_WORDS]
+        if not words:
+            return []
+
+        # The typed last word may be incomplete, so it also matches as a raw
+        # prefix; its stem only matches exactly, or "date" -> "dat" would
+        # pull in "databas"
+        query_terms = [[term] for term in words[:-1]]
+        query_terms.append(sorted(set(self.expand_prefix(raw[-1])) | {words[-1]}))
+
+        count = len(self.sections)
+        scores = Counter()
+        for alternatives in query_terms:
+            # One query word scores as its best-matching alternative, not the sum
+            word_scores = {}
+            for term in alternatives:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings:
+                    norm = 1.2 * (0.25 + 0.75 * self.lengths[doc_id] / self.average_length)
+                    word_scores[doc_id] = max(word_scores.get(doc_id, 0.0), idf * tf * 2.2 / (tf + norm))
+            scores.update(word_scores)
+
+        matched = {term for alternatives in query_terms for term in alternatives}
+        results = []
+        for doc_id, score in scores.most_common(limit):
+            section = self.sections[doc_id]
+            results.append({
+                'title': section['title'],
+                'anchor': section['anchor'],
+                'url': f"/doc.html#{section['anchor']}",
+                'score': round(score, 4),
+                'snippet': make_snippet(section['text'], self.tokens[doc_id], matched)
+            })
+        return results
+
+
+def make_snippet(text, tokens, terms):
+    """
+    HTML-escaped window around the first matching word, matches in <mark>
+    """
+    width = SEARCH_CONFIG['snippet_chars']
+    hits = [(start, end) for term, start, end in tokens if term in terms]
+    if not hits:
+        return html.escape(text[:width])
+
+    window_start = max(0, hits[0][0] - width // 3)
+    window_end = min(len(text), window_start + width)
+    parts = ['…' if window_start else '']
+    position = window_start
+    for start, end in hits:
+        if start < window_start or end > window_end:
+            continue
+        parts.append(html.escape(text[position:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        position = end
+    parts.append(html.escape(text[position:window_end]))
+    parts.append('…' if window_end < len(text) else '')
+    return ''.join(parts)
+
+
+def _read_source():
+    with open(SEARCH_CONFIG['source'], encoding="utf-8") as file:
+        return file.read(), os.path.getmtime(SEARCH_CONFIG['source'])
+
+
+def build_index(previous_sections=None, previous=None):
+    """
+    Index doc.html, reusing term counts from previous_sections and snippet
+    offsets from the previous in-memory index where sections are unchanged
+    """
+    source_html, mtime = _read_source()
+    return DocSearchIndex(build_sections(source_html, previous_sections), mtime, previous)
+
+
+def save_index(index):
+    """
+    Write the index atomically through a temp file unique to this writer, so
+    workers rebuilding at the same time cannot interleave their output
+    """
+    data = {'source_mtime': index.source_mtime, 'sections': index.sections}
+    index_path = SEARCH_CONFIG['index_path']
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.',
+                                    prefix=os.path.basename(index_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_index():
+    """
+    Load the prebuilt index, rebuilding (and saving) it if doc.html is newer
+    """
+    previous = None
+    try:
+        with open(SEARCH_CONFIG['index_path'], encoding="utf-8") as file:
+            data = json.load(file)
+        if data['source_mtime'] == os.path.getmtime(SEARCH_CONFIG['source']):
+            return DocSearchIndex(data['sections'], data['source_mtime'])
+        previous = data['sections']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_index(previous)
+    try:
+        save_index(index)
+    except OSError as e:
+        logger.warning(f"Could not save doc search index: {str(e)}")
+    return index
+
+
+class DocSearch:
+    """
+    Holds the current index and swaps in an incremental rebuild when doc.html changes
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+
+    def load(self):
+        """
+        Load the index now rather than on the first search. A missing or
+        unreadable doc.html is logged and left for the first search to retry.
+        """
+        with self._lock:
+            if self._index is not None:
+                return
+            try:
+                self._index = load_index()
+                self._checked_at = time.monotonic()
+            except OSError as e:
+                logger.error(f"Could not load doc search index: {str(e)}")
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = load_index()
+                    self._checked_at = time.monotonic()
+        self._maybe_reload()
+        return self._index
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < SEARCH_CONFIG['check_interval']:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(SEARCH_CONFIG['source'])
+            except OSError:
+                return
+            if mtime != self._index.source_mtime:
+                self._index = build_index(self._index.sections, self._index)
+                # Cached results hold the old index; drop them so it can be freed
+                _cached_search.cache_clear()
+                try:
+                    save_index(self._index)
+                except OSError as e:
+                    logger.warning(f"Could not save doc search index: {str(e)}")
+        finally:
+            self._lock.release()
+
+    def search(self, query, limit=None):
+        index = self.index
+        limit = min(limit or SEARCH_CONFIG['max_results'], SEARCH_CONFIG['max_results'])
+        return index.version, _cached_search(index, ' '.join(query.split()).lower(), limit)
+
+
+@lru_cache(maxsize=1024)
+def _cached_search(index, query, limit):
+    return index.search(query, limit)
+
+
+doc_search = DocSearch()
+
+# Load at import so a preloaded gunicorn master builds the index once and
+# every worker inherits it; the build step below does its own timed load
+if __name__ != "__main__":
+    doc_search.load()
+
+
+if __name__ == "__main__":
+    # Build step: python doc_search.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    started = time.perf_counter()
+    index = load_index()
+    logger.info(f"Doc search index ready: {len(index.sections)} sections, {len(index.vocabulary)} terms, "
+                f"{(time.perf_counter() - started) * 1000:.1f} ms -> {SEARCH_CONFIG['index_path']}")
@@ -0,0 +1,133 @@
+# Gunicorn configuration for the NIMBLE server
+#
+#   gunicorn -c gunicorn.conf.py server:app      (or: python server.py)
+#
+# Worker models (WORKER_CLASS):
+#   sync     one request per process; simplest, but a slow Stripe/Cryptlex
+#            call blocks the whole worker
+#   gthread  (default) a thread pool per process; threads beyond the admission
+#            limits in admission.py keep static pages responsive while an
+#            upstream is slow
+#   gevent   cooperative greenlets; best for many concurrent upstream waits.
+#            Requires the gevent package
+#
+# Benchmark (python benchmark.py, 1 vCPU sandbox, simulated upstream with
+# 200 ms latency, 32 clients on /check-active-license plus 4 clients on /,
+# 15 s per run, default admission limits of 4 concurrent + 8 queued Cryptlex
+# calls per worker; 3 sync workers, 2 gthread workers x 38 threads, 1 gevent
+# worker). shed counts 503s from admission control:
+#
+#   worker     license req/s   license p50/p99 ms   index p50/p99 ms   shed  errors
+#   sync                16.4      2204 / 2348        2071 / 2135          0       0
+#   gthread             36.3       675 / 1149          10 / 35          114      26
+#   gevent              11.2       430 / 785           62 / 85         5437       0
+#
+# With sync workers every process spends most of its time waiting on the
+# upstream, so static pages queue behind license checks. gthread and gevent
+# keep serving index.html while upstream calls are in flight. Their license
+# throughput is capped by the bulkhead at workers x max_concurrent calls per
+# 200 ms, and load beyond the queue is shed quickly rather than left waiting;
+# raise WEB_CONCURRENCY or CRYPTLEX_MAX_CONCURRENT for more upstream
+# capacity. The gthread errors are keep-alive connections closed by the
+# server as the client reused them.
+
+import os
+import sys
+import math
+import multiprocessing
+from dotenv import load_dotenv
+
+# Run from the app directory wherever gunicorn is started, so server:app
+# imports and relative data paths resolve the same way. gunicorn only applies
+# chdir after reading this file, so make the app modules importable here too.
+chdir = os.path.dirname(os.path.abspath(__file__))
+if chdir not in sys.path:
+    sys.path.insert(0, chdir)
+
+# The sizing below reads admission limits, so pick up .env before anything else
+load_dotenv(os.path.join(chdir, '.env'))
+
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+
+# gevent must patch the standard library before the app is preloaded
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from admission import ADMISSION_CONFIG
+
+cpu_count = multiprocessing.cpu_count()
+
+# Requests a worker may hold for upstream calls: every admitted and queued
+# slot across all dependencies. gthread workers need threads beyond this, or
+# upstream-bound requests can occupy every thread and static pages stall.
+admission_slots = sum(config['max_concurrent'] + config['max_queue'] for config in ADMISSION_CONFIG.values())
+thread_headroom = int(os.getenv('GUNICORN_THREAD_HEADROOM', 8))
+
+bind = f"0.0.0.0:{os.getenv('PORT', 4242)}"
+
+# Worker counts derived from the CPU count and gthread threads from the
+# admission limits; WEB_CONCURRENCY, GUNICORN_THREADS and WORKER_CONNECTIONS
+# override them
+if worker_class == 'sync':
+    workers = int(os.getenv('WEB_CONCURRENCY', 2 * cpu_count + 1))
+    threads = 1
+elif worker_class == 'gthread':
+    workers = int(os.getenv('WEB_CONCURRENCY', cpu_count + 1))
+    threads = int(os.getenv('GUNICORN_THREADS', admission_slots + thread_headroom))
+elif worker_class == 'gevent':
+    workers = int(os.getenv('WEB_CONCURRENCY', cpu_count))
+    worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+else:
+    raise RuntimeError(f"Unsupported WORKER_CLASS: {worker_class} (use sync, gthread or gevent)")
+
+# Load the app once in the master; workers get per-process pools in post_fork
+preload_app = True
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv('MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', 100))
+
+# Longest an admitted request can take: queueing plus every upstream call
+# running to its timeout (a checkout is 2 s + 3 x 20 s with the defaults)
+longest_request = max(
+    config['queue_timeout'] + config['calls_per_request'] * config['timeout']
+    for config in ADMISSION_CONFIG.values()
+)
+
+# On SIGTERM workers stop accepting and get this long to finish in-flight
+# requests, so a checkout is not cut off between creating the customer and
+# the session. Sync workers are also killed after timeout seconds of one
+# request, so it must outlast the slowest one too.
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', math.ceil(longest_request) + 5))
+timeout = int(os.getenv('WORKER_TIMEOUT', max(60, math.ceil(longest_request) + 10)))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+accesslog = os.getenv('ACCESS_LOG')
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    server.log.info(f"Starting {workers} {worker_class} workers"
+                    + (f" x {threads} threads" if worker_class == 'gthread' else ""))
+    if worker_class == 'gthread' and threads <= admission_slots:
+        server.log.warning(f"GUNICORN_THREADS={threads} does not exceed the {admission_slots} admission slots "
+                           f"per worker; slow upstreams can starve static pages")
+
+
+def post_fork(server, worker):
+    # Sockets opened in the master must not be shared between workers
+    from server import init_http_clients
+    init_http_clients()
+
+    # Threads do not survive the fork, so each worker starts its prober thread;
+    # one worker at a time holds the lock and probes for all of them
+    import health
+    health.prober.ensure_started()
+
+
+def worker_exit(server, worker):
+    # In-flight requests have drained; give queued trace spans a chance to export
+    import tracing
+    tracing.exporter.flush(timeout=5)
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import smtplib
+import logging
+import threading
+import requests
+
+logger = logging.getLogger("health")
+
+# Environment checked at startup and reported by /readyz
+REQUIRED_ENV_VARS = [
+    'STRIPE_SECRET_KEY',
+    'STRIPE_PUBLISHABLE_KEY',
+    'CRYPTLEX_TOKEN',
+    'CLOUDFLARE_WORKER_URL',
+    'STRIPE_PRICE_WEB_ID',
+    'STRIPE_PRICE_MOBILE_ID',
+    'STRIPE_PRICE_COMBO_ID',
+    'STRIPE_PRICE_CROSS_ID'
+]
+
+# Optional environment variables with defaults
+OPTIONAL_ENV_VARS = {
+    'EMAIL_USERNAME': 'Email username for contact form',
+    'EMAIL_PASSWORD': 'Email password for contact form',
+    'EMAIL_FROM': 'Sender email for contact form'
+}
+
+# Background prober configuration
+HEALTH_CONFIG = {
+    'interval': float(os.getenv('HEALTH_PROBE_INTERVAL', 30)),
+    'timeout': float(os.getenv('HEALTH_PROBE_TIMEOUT', 5)),
+    # Results older than this are treated as unknown
+    'max_age': float(os.getenv('HEALTH_PROBE_MAX_AGE', 120)),
+    # One process per host probes and shares its results through this file;
+    # the others read it. The prober holds an exclusive lock on state_path.lock
+    'state_path': os.getenv('HEALTH_STATE_FILE', 'health_state.json'),
+    'endpoints': {
+        'stripe': 'https://api.stripe.com/v1',
+        'cryptlex': os.getenv('CRYPTLEX_API_URL', 'https://api.eu.cryptlex.com/v3')
+    }
+}
+
+
+def missing_env_vars():
+    """
+    Return the required environment variables that are not set
+    """
+    return [var for var in REQUIRED_ENV_VARS if not os.getenv(var)]
+
+
+def missing_optional_env_vars():
+    """
+    Return (name, description) for optional environment variables that are not set
+    """
+    return [(var, description) for var, description in OPTIONAL_ENV_VARS.items() if not os.getenv(var)]
+
+
+def probe_http(url, timeout):
+    """
+    An upstream is reachable if it answers at all without a server error;
+    unauthenticated probes are expected to get 401/404
+    """
+    response = requests.get(url, timeout=timeout)
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+
+def probe_smtp(timeout):
+    """
+    Connect to the contact form's SMTP server and exchange a NOOP
+    Returns False if SMTP credentials are not configured
+    """
+    from contact_form import EMAIL_CONFIG
+
+    smtp_settings = EMAIL_CONFIG['smtp']
+    if not smtp_settings['username'] or not smtp_settings['password']:
+        return False
+
+    server = smtplib.SMTP(smtp_settings['host'], smtp_settings['port'], timeout=timeout)
+    try:
+        server.noop()
+    finally:
+        server.quit()
+    return True
+
+
+class HealthProber:
+    """
+    Probes upstream dependencies on a background thread and caches the
+    results, so readiness checks never make outbound calls themselves.
+    Every worker runs the thread, but only the one holding the state file
+    lock probes; if it exits, another worker takes the lock on its next tick.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pid = None
+        self._lock_file = None
+
+    def ensure_started(self):
+        """
+        Start the probe thread in this process. Threads do not survive a
+        fork, so gunicorn's post_fork hook calls this in every worker.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._results = {}
+            self._lock_file = None
+        thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            if self._acquire_probe_lock():
+                self.probe_all()
+                self._write_state()
+            time.sleep(self.config['interval'])
+
+    def _acquire_probe_lock(self):
+        """
+        Returns True if this process is the one that probes
+        """
+        if self._lock_file is not None:
+            return True
+        try:
+            lock_file = open(self.config['state_path'] + '.lock', 'a')
+        except OSError as e:
+            logger.error(f"Cannot open health probe lock: {str(e)}")
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held until the process exits, which releases the lock
+        self._lock_file = lock_file
+        return True
+
+    def _write_state(self):
+        with self._lock:
+            results = dict(self._results)
+        state_path = self.config['state_path']
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(state_path) or '.',
+                                            prefix=os.path.basename(state_path) + '.', suffix='.tmp')
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(results, file)
+            os.replace(tmp_path, state_path)
+        except OSError as e:
+            logger.error(f"Failed to write health probe results: {str(e)}")
+
+    def _shared_results(self):
+        if self._lock_file is not None:
+            with self._lock:
+                return {name: dict(result) for name, result in self._results.items()}
+        try:
+            with open(self.config['state_path'], encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _record(self, name, status, error=None):
+        result = {'status': status, 'checked_at': time.time()}
+        if error:
+            result['error'] = error
+        with self._lock:
+            previous = self._results.get(name, {}).get('status')
+            self._results[name] = result
+        # Only log transitions so a healthy prober stays quiet
+        if previous != status:
+            log = logger.info if status in ('ok', 'not_configured') else logger.warning
+            log(f"Health probe {name}: {previous or 'unknown'} -> {status}{f' ({error})' if error else ''}")
+
+    def probe_all(self):
+        for name, url in self.config['endpoints'].items():
+            try:
+                probe_http(url, self.config['timeout'])
+                self._record(name, 'ok')
+            except Exception as e:
+                self._record(name, 'unreachable', str(e))
+
+        try:
+            configured = probe_smtp(self.config['timeout'])
+            self._record('smtp', 'ok' if configured else 'not_configured')
+        except Exception as e:
+            self._record('smtp', 'unreachable', str(e))
+
+    def report(self):
+        """
+        Build the readiness report from cached probe results
+        """
+        now = time.time()
+        results = self._shared_results()
+
+        checks = {}
+        for name in list(self.config['endpoints']) + ['smtp']:
+            result = results.get(name)
+            if result is None:
+                checks[name] = {'status': 'unknown'}
+                continue
+            age = now - result.pop('checked_at')
+            result['age_seconds'] = round(age, 1)
+            if age > self.config['max_age']:
+                result['status'] = 'stale'
+            checks[name] = result
+
+        missing = missing_env_vars()
+        checks['environment'] = {'status': 'ok'} if not missing else {'status': 'missing', 'missing': missing}
+
+        # Only local state gates readiness. Upstream results are reported for
+        # visibility, but an outage at Stripe or Cryptlex is the same for every
+        # worker and is handled per request by the circuit breakers, so pulling
+        # workers out of rotation would not help. The contact form degrades on
+        # its own, so SMTP is informational too.
+        required = ['environment']
+        ready = all(checks[name]['status'] == 'ok' for name in required)
+        return {'ready': ready, 'checks': checks}
+
+
+prober = HealthProber(HEALTH_CONFIG)
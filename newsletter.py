@@ -5,11 +5,13 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import re
 from dotenv import load_dotenv
+import tracing
+from admission import ADMISSION_CONFIG, upstream_call
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s',
     handlers=[
         logging.FileHandler("newsletter.log"),
         logging.StreamHandler()
@@ -99,16 +101,19 @@ def send_confirmation_email(email):
     msg.attach(part2)
     
     try:
-        # Connect to server
-        server = smtplib.SMTP(EMAIL_CONFIG['smtp']['host'], EMAIL_CONFIG['smtp']['port'])
-        server.starttls()
+        with tracing.span("smtp.send.confirmation", **{"smtp.host": EMAIL_CONFIG['smtp']['host']}), \
+                upstream_call("smtp"):
+            # Connect to server
+            server = smtplib.SMTP(EMAIL_CONFIG['smtp']['host'], EMAIL_CONFIG['smtp']['port'],
+                                  timeout=ADMISSION_CONFIG['smtp']['timeout'])
+            server.starttls()
         
-        # Login
-        server.login(username, password)
+            # Login
+            server.login(username, password)
         
-        # Send email
-        server.sendmail(from_email, email, msg.as_string())
-        server.quit()
+            # Send email
+            server.sendmail(from_email, email, msg.as_string())
+            server.quit()
         
         logger.info(f"Confirmation email sent to {email}")
         return True, "Confirmation email sent"
@@ -149,16 +154,19 @@ def send_admin_notification(email):
     msg.attach(MIMEText(text, 'plain'))
     
     try:
-        # Connect to server
-        server = smtplib.SMTP(EMAIL_CONFIG['smtp']['host'], EMAIL_CONFIG['smtp']['port'])
-        server.starttls()
+        with tracing.span("smtp.send.admin_notification", **{"smtp.host": EMAIL_CONFIG['smtp']['host']}), \
+                upstream_call("smtp"):
+            # Connect to server
+            server = smtplib.SMTP(EMAIL_CONFIG['smtp']['host'], EMAIL_CONFIG['smtp']['port'],
+                                  timeout=ADMISSION_CONFIG['smtp']['timeout'])
+            server.starttls()
         
-        # Login
-        server.login(username, password)
+            # Login
+            server.login(username, password)
         
-        # Send email
-        server.sendmail(from_email, admin_email, msg.as_string())
-        server.quit()
+            # Send email
+            server.sendmail(from_email, admin_email, msg.as_string())
+            server.quit()
         
         logger.info(f"Admin notification sent about new subscriber: {email}")
         return True, "Admin notification sent"
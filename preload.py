@@ -0,0 +1,151 @@
+import os
+import re
+import logging
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger("preload")
+
+# Pages whose critical assets are preloaded
+PRELOAD_CONFIG = {
+    'pages': ['index.html', 'doc.html', 'success.html', 'cancel.html', 'thankyou.html'],
+    # Element id whose first image is the above-the-fold hero
+    'hero_id': 'hero',
+    # Send 103 Early Hints where the server supports them. Browsers handle
+    # them, but some clients do not: Python's http.client (and so requests)
+    # reads a 103 as the final response
+    'early_hints': os.getenv('PRELOAD_EARLY_HINTS', '1') == '1'
+}
+
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+FONT_URL_PATTERN = re.compile(r"url\(\s*['\"]?([^'\")]+\.woff2(?:\?[^'\")]*)?)['\"]?\s*\)")
+
+
+class CriticalAssetParser(HTMLParser):
+    """
+    Collect stylesheets, parser-blocking scripts and the hero image of a page
+    """
+
+    def __init__(self, hero_id):
+        super().__init__()
+        self.hero_id = hero_id
+        self.stylesheets = []
+        self.scripts = []
+        self.hero_image = None
+        self._hero_depth = None
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and 'stylesheet' in (attrs.get('rel') or '').split() and attrs.get('href'):
+            self.stylesheets.append(attrs['href'])
+        elif tag == 'script' and attrs.get('src'):
+            if 'async' not in attrs and 'defer' not in attrs and attrs.get('type') != 'module':
+                self.scripts.append(attrs['src'])
+        elif tag == 'img' and self._hero_depth is not None and self.hero_image is None and attrs.get('src'):
+            self.hero_image = attrs['src']
+
+        if tag in VOID_ELEMENTS:
+            return
+        self._depth += 1
+        if attrs.get('id') == self.hero_id and self._hero_depth is None:
+            self._hero_depth = self._depth
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        if self._hero_depth is not None and self._depth == self._hero_depth:
+            self._hero_depth = None
+        self._depth -= 1
+
+
+def _is_local(url):
+    parts = urlsplit(url)
+    return not parts.scheme and not parts.netloc
+
+
+def _stylesheet_fonts(static_folder, stylesheet_url):
+    """
+    woff2 fonts referenced by a local stylesheet, as absolute URLs
+    """
+    path = os.path.join(static_folder, urlsplit(stylesheet_url).path.lstrip('/'))
+    try:
+        with open(path, encoding="utf-8") as file:
+            css = file.read()
+    except OSError:
+        return []
+    return [urljoin(stylesheet_url, match) for match in FONT_URL_PATTERN.findall(css)]
+
+
+def critical_assets(static_folder, page):
+    """
+    Return [(url, as, extra attributes)] for a page in load-priority order
+    """
+    with open(os.path.join(static_folder, page), encoding="utf-8") as file:
+        html = file.read()
+
+    parser = CriticalAssetParser(PRELOAD_CONFIG['hero_id'])
+    parser.feed(html)
+    page_url = '/' + page
+
+    assets = []
+    stylesheets = [urljoin(page_url, href) for href in parser.stylesheets if _is_local(href)]
+    for url in stylesheets:
+        assets.append((url, 'style', ''))
+    for url in stylesheets:
+        for font in _stylesheet_fonts(static_folder, url):
+            assets.append((font, 'font', '; type="font/woff2"; crossorigin'))
+    if parser.hero_image and _is_local(parser.hero_image):
+        assets.append((urljoin(page_url, parser.hero_image), 'image', ''))
+    for src in parser.scripts:
+        if _is_local(src):
+            assets.append((urljoin(page_url, src), 'script', ''))
+
+    # Keep the first occurrence of anything referenced twice
+    seen = set()
+    return [asset for asset in assets if not (asset[0] in seen or seen.add(asset[0]))]
+
+
+def build_preload_table(static_folder):
+    """
+    Scan each configured page once and precompute its Link header value
+    """
+    table = {}
+    for page in PRELOAD_CONFIG['pages']:
+        try:
+            assets = critical_assets(static_folder, page)
+        except OSError as e:
+            logger.error(f"Skipping preload hints for {page}: {str(e)}")
+            continue
+        table[page] = ', '.join(f"<{url}>; rel=preload; as={kind}{extra}" for url, kind, extra in assets)
+        logger.info(f"Preload hints for {page}: {len(assets)} assets")
+    return table
+
+
+def send_early_hints(environ, page, table):
+    """
+    Send a 103 Early Hints response with the page's Link header before the
+    page itself is read, where the server supports it (gunicorn's gthread and
+    gevent workers provide wsgi.early_hints; the dev server does not)
+    """
+    early_hints = environ.get('wsgi.early_hints')
+    link = table.get(page)
+    if early_hints is None or not link or not PRELOAD_CONFIG['early_hints']:
+        return
+    try:
+        early_hints([('Link', link)])
+    except OSError as e:
+        logger.debug(f"Could not send Early Hints for {page}: {str(e)}")
+
+
+def add_preload_headers(response, page, table):
+    """
+    Attach the precomputed Link header to a page response. This is the
+    fallback for servers without wsgi.early_hints, and lets a fronting proxy
+    such as Cloudflare derive its own Early Hints for later visits.
+    """
+    link = table.get(page)
+    if link and response.status_code in (200, 304):
+        response.headers['Link'] = link
+    return response
@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+import hmac
+import itertools
+import random
+import inspect
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from functools import wraps
+from flask import g, request, jsonify, abort
+import tracing
+
+logger = logging.getLogger("profiling")
+
+# Profiling is off unless a sample rate is set or an admin token is configured
+PROFILING_CONFIG = {
+    # Fraction of requests to profile, e.g. 0.01 for 1%
+    'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    # Requests carrying this header and a valid X-Admin-Token are always profiled
+    'force_header': 'X-Profile',
+    'admin_token': os.getenv('ADMIN_TOKEN'),
+    'interval': float(os.getenv('PROFILE_INTERVAL', 0.005)),
+    'output_dir': os.getenv('PROFILE_DIR', 'profiles'),
+    'max_files': int(os.getenv('PROFILE_MAX_FILES', 50)),
+    'tracemalloc_frames': int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 10)),
+    'memory_top': int(os.getenv('PROFILE_MEMORY_TOP', 25))
+}
+
+# Top-level modules reported separately in the wall-clock breakdown.
+# The outermost match wins, so Stripe's own use of requests counts as stripe.
+UPSTREAM_MODULES = {
+    'stripe': 'stripe',
+    'requests': 'requests',
+    'urllib3': 'requests',
+    'smtplib': 'smtplib'
+}
+
+# Previous tracemalloc snapshot for this worker, used for diffs
+_last_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def is_admin(req):
+    """
+    Check the X-Admin-Token header against ADMIN_TOKEN
+    """
+    token = PROFILING_CONFIG['admin_token']
+    supplied = req.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def _frame_label(frame):
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def _frame_category(stack):
+    for frame in stack:
+        module = frame.f_globals.get('__name__', '')
+        category = UPSTREAM_MODULES.get(module.split('.')[0])
+        if category:
+            return category
+    return 'app'
+
+
+def _green_threads():
+    """
+    True when gevent has patched threading (WORKER_CLASS=gevent). Requests
+    then run on greenlets, whose ids never appear in sys._current_frames().
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _current_task():
+    """
+    The greenlet under gevent, otherwise the OS thread id
+    """
+    if _green_threads():
+        import gevent
+        return gevent.getcurrent()
+    return threading.get_ident()
+
+
+# Sequence number for profile files written by this process
+_profile_counter = itertools.count()
+
+
+class StackSampler:
+    """
+    Wall-clock sampling profiler for the threads serving one request. Under
+    gevent the sampler is itself a greenlet and reads the suspended request
+    greenlets' frames, so it samples whenever the request yields (upstream
+    I/O) but CPU-bound stretches are under-counted.
+    """
+
+    def __init__(self, interval, forced=False):
+        self.interval = interval
+        self.forced = forced
+        self.green = _green_threads()
+        self.tasks = {_current_task()}
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.started_at = 0.0
+        self.elapsed = 0.0
+
+    def add_task(self, task):
+        """Also sample a thread the request has moved onto, e.g. an async view's loop"""
+        self.tasks.add(task)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.green:
+                frames = {task: task.gr_frame for task in list(self.tasks)}
+            else:
+                frames = sys._current_frames()
+            # A request thread blocked on its async view's loop thread would
+            # otherwise dilute the breakdown, so each tick counts once and an
+            # upstream category beats 'app'
+            tick_category = None
+            for task in list(self.tasks):
+                frame = frames.get(task)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame)
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[';'.join(_frame_label(f) for f in stack)] += 1
+                category = _frame_category(stack)
+                if tick_category in (None, 'app'):
+                    tick_category = category
+            if tick_category is not None:
+                self.categories[tick_category] += 1
+                self.samples += 1
+
+    def breakdown(self):
+        """
+        Milliseconds of wall-clock time per category, scaled to the measured duration
+        """
+        total_ms = self.elapsed * 1000
+        if not self.samples:
+            return {'total': round(total_ms, 1)}
+        result = {name: round(total_ms * count / self.samples, 1) for name, count in self.categories.items()}
+        result['total'] = round(total_ms, 1)
+        return result
+
+    def write_collapsed(self, name):
+        """
+        Write stacks in collapsed format (flamegraph.pl, speedscope) and
+        prune the output directory down to max_files
+        """
+        output_dir = PROFILING_CONFIG['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        # Request IDs can be client-supplied, so a per-process counter keeps names unique
+        filename = (f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_counter)}"
+                    f"-{tracing.get_request_id()}-{name}.collapsed")
+        path = os.path.join(output_dir, filename)
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.items():
+                file.write(f"{stack} {count}\n")
+
+        files = sorted(
+            (os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith('.collapsed')),
+            key=os.path.getmtime
+        )
+        for old in files[:-PROFILING_CONFIG['max_files']]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+
+def _start_profile():
+    forced = request.headers.get(PROFILING_CONFIG['force_header']) and is_admin(request)
+    sampled = PROFILING_CONFIG['sample_rate'] > 0 and random.random() < PROFILING_CONFIG['sample_rate']
+    if not (forced or sampled):
+        return
+    sampler = StackSampler(PROFILING_CONFIG['interval'], forced=bool(forced))
+    g._profiler = sampler
+    sampler.start()
+
+
+def _finish_profile(response):
+    sampler = g.pop('_profiler', None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    breakdown = sampler.breakdown()
+    name = (request.endpoint or 'unknown').replace('/', '_')
+    try:
+        path = sampler.write_collapsed(name)
+    except OSError as e:
+        logger.error(f"Failed to write profile for {request.path}: {str(e)}")
+        path = None
+    logger.info(f"Profiled {request.method} {request.path}: {breakdown} -> {path}")
+
+    # Only show timings to the admin who asked for them
+    if sampler.forced:
+        response.headers['Server-Timing'] = ', '.join(f"{k};dur={v}" for k, v in breakdown.items())
+    return response
+
+
+def _discard_profile(exc):
+    # after_request is skipped when a view raises; make sure the sampler stops
+    sampler = g.pop('_profiler', None)
+    if sampler is not None:
+        sampler.stop()
+
+
+def init_app(app):
+    """
+    Install request sampling hooks and the memory snapshot endpoint
+    """
+    if PROFILING_CONFIG['sample_rate'] <= 0 and not PROFILING_CONFIG['admin_token']:
+        return
+
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_discard_profile)
+
+    # Async views run on an event loop in another thread; follow them there
+    original_ensure_sync = app.ensure_sync
+
+    def ensure_sync(func):
+        if not inspect.iscoroutinefunction(func):
+            return original_ensure_sync(func)
+
+        @wraps(func)
+        async def profiled(*args, **kwargs):
+            sampler = g.get('_profiler')
+            if sampler is not None:
+                sampler.add_task(_current_task())
+            return await func(*args, **kwargs)
+        return original_ensure_sync(profiled)
+
+    app.ensure_sync = ensure_sync
+
+    @app.route("/admin/memory/snapshot", methods=["GET"])
+    def memory_snapshot():
+        """
+        Take a tracemalloc snapshot of this worker and diff it against the previous one
+        Pass ?reset=1 to stop tracing and discard the baseline
+        """
+        global _last_snapshot
+        if not is_admin(request):
+            abort(404)
+
+        with _snapshot_lock:
+            if request.args.get('reset'):
+                tracemalloc.stop()
+                _last_snapshot = None
+                return jsonify({"pid": os.getpid(), "tracing": False})
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILING_CONFIG['tracemalloc_frames'])
+
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+            ])
+            previous, _last_snapshot = _last_snapshot, snapshot
+
+        top = PROFILING_CONFIG['memory_top']
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "pid": os.getpid(),
+            "tracing": True,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [str(stat) for stat in snapshot.statistics('lineno')[:top]]
+        }
+        if previous is not None:
+            result["diff"] = [str(stat) for stat in snapshot.compare_to(previous, 'lineno')[:top]]
+        return jsonify(result)
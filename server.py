@@ -1,20 +1,30 @@
 import os
 import stripe
 import requests
-from flask import Flask, jsonify, request, send_from_directory, redirect
+from flask import Flask, jsonify, request, send_from_directory, redirect, abort
 from dotenv import load_dotenv
 import json
-from flask_cors import CORS
+import hashlib
 import logging
 import sys
 
-# Load environment variables from .env file
+# Load environment variables from .env file before importing the local
+# modules below, which read their configuration at import time
 load_dotenv()
 
+import tracing
+import admission
+import health
+import profiling
+import preload
+import cors
+from doc_search import doc_search
+from admission import shed_load, upstream_call
+
 # Configure logging with immediate flushing
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s',
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger("nimble-server")
@@ -27,22 +37,15 @@ sys.stderr.reconfigure(line_buffering=True)
 app = Flask(__name__, static_folder="public")
 app.logger.setLevel(logging.INFO)
 
-# Configure CORS
-CORS(app, resources={
-    r"/*": {
-        "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
-
-# Add explicit CORS configuration
-@app.after_request
-def after_request(response):
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+# Correlation IDs and per-request spans (TRACE_SAMPLE_RATE / TRACE_FILE / TRACE_OTLP_ENDPOINT)
+tracing.init_app(app)
+
+# Opt-in request profiling and memory snapshots (PROFILE_SAMPLE_RATE / ADMIN_TOKEN)
+profiling.init_app(app)
+
+# Configure CORS for the API paths only (CORS_ORIGINS / CORS_MAX_AGE);
+# preflights are answered before routing
+app.wsgi_app = cors.CORSMiddleware(app.wsgi_app, cors.CORS_CONFIG)
 
 app.debug = False
 
@@ -50,6 +53,7 @@ app.debug = False
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 CRYPTLEX_TOKEN = os.getenv("CRYPTLEX_TOKEN")
+CRYPTLEX_API_URL = os.getenv("CRYPTLEX_API_URL", "https://api.eu.cryptlex.com/v3")
 WORKER_URL = os.getenv('CLOUDFLARE_WORKER_URL', 'https://stripe-webhook-test.siddharth-g.workers.dev/')
 YOUR_DOMAIN = os.getenv('DOMAIN_URL', "http://localhost:4242")
 
@@ -62,15 +66,60 @@ def log_error(message):
     logger.error(message)
     sys.stdout.flush()
 
+# Pooled HTTP clients for upstream calls
+cryptlex_session = None
+
+def init_http_clients():
+    """
+    Create this process's keep-alive HTTP pools for Cryptlex and Stripe.
+    Gunicorn calls this again in each worker after fork (see gunicorn.conf.py)
+    so workers never share sockets inherited from the master.
+    """
+    global cryptlex_session
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=admission.ADMISSION_CONFIG['cryptlex']['max_concurrent']
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    cryptlex_session = session
+
+    # RequestsClient keeps one keep-alive session per thread
+    stripe.default_http_client = stripe.RequestsClient(timeout=admission.ADMISSION_CONFIG['stripe']['timeout'])
+
+init_http_clients()
+
+# Liveness: constant time, no logging, no upstream calls
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return "ok", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"}
+
+# Readiness: served from the background prober's cached results
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    report = health.prober.report()
+    response = jsonify(report)
+    response.status_code = 200 if report["ready"] else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+# Link: rel=preload hints for each HTML page, computed once at startup
+PRELOAD_TABLE = preload.build_preload_table(app.static_folder)
+
 # Serve static files
 @app.route("/")
 def serve_index():
     log_info("Serving index.html")
-    return send_from_directory("public", "index.html")
+    preload.send_early_hints(request.environ, "index.html", PRELOAD_TABLE)
+    response = send_from_directory("public", "index.html")
+    return preload.add_preload_headers(response, "index.html", PRELOAD_TABLE)
 
 @app.route("/<path:filename>")
 def serve_static(filename):
-    return send_from_directory("public", filename)
+    preload.send_early_hints(request.environ, filename, PRELOAD_TABLE)
+    response = send_from_directory("public", filename)
+    return preload.add_preload_headers(response, filename, PRELOAD_TABLE)
 
 # Get Stripe Publishable Key
 @app.route("/get-stripe-key", methods=["GET"])
@@ -96,8 +145,16 @@ def get_product_ids():
         "versions": versions
     })
 
+# Admission control state for upstream-bound routes (admin only)
+@app.route("/admission/stats", methods=["GET"])
+def admission_stats():
+    if not profiling.is_admin(request):
+        abort(404)
+    return jsonify(admission.stats())
+
 # Check for active license
 @app.route("/check-active-license", methods=["POST"])
+@shed_load("cryptlex")
 def check_active_license():
     try:
         data = request.get_json()
@@ -115,8 +172,15 @@ def check_active_license():
             "suspended": False,
             "limit": 1
         }
-        endpoint = "https://api.eu.cryptlex.com/v3/licenses?" + "&".join(f"{k}={v}" for k, v in query_params.items())
-        response = requests.get(endpoint, headers={"Authorization": f"Bearer {CRYPTLEX_TOKEN}"})
+        endpoint = f"{CRYPTLEX_API_URL}/licenses?" + "&".join(f"{k}={v}" for k, v in query_params.items())
+        with tracing.span("cryptlex.licenses.list"), upstream_call("cryptlex") as call:
+            response = cryptlex_session.get(
+                endpoint,
+                headers={"Authorization": f"Bearer {CRYPTLEX_TOKEN}"},
+                timeout=admission.ADMISSION_CONFIG['cryptlex']['timeout']
+            )
+            if response.status_code >= 500:
+                call.fail()
         
         if response.status_code == 200:
             existing_license = response.json()
@@ -151,6 +215,7 @@ def get_price_id(product_version_id):
 
 # Create Stripe Checkout Session
 @app.route("/create-checkout-session", methods=["POST"])
+@shed_load("stripe")
 async def create_checkout_session():
     try:
         data = request.get_json()
@@ -168,16 +233,18 @@ async def create_checkout_session():
             log_error(error_msg)
             return jsonify({"error": error_msg}), 400
 
-        customers = stripe.Customer.list(email=org_email, limit=1)
+        with tracing.span("stripe.Customer.list"), upstream_call("stripe", ignore=(stripe.InvalidRequestError,)):
+            customers = stripe.Customer.list(email=org_email, limit=1)
         if customers.data:
             stripe_customer = customers.data[0]
             log_info(f"Found existing Stripe customer: {stripe_customer.id}")
         else:
-            stripe_customer = stripe.Customer.create(
-                email=org_email,
-                name=org_domain.split('.')[0].upper(),
-                metadata={"organization_domain": org_domain}
-            )
+            with tracing.span("stripe.Customer.create"), upstream_call("stripe", ignore=(stripe.InvalidRequestError,)):
+                stripe_customer = stripe.Customer.create(
+                    email=org_email,
+                    name=org_domain.split('.')[0].upper(),
+                    metadata={"organization_domain": org_domain}
+                )
             log_info(f"Created new Stripe customer: {stripe_customer.id}")
 
         price_id = get_price_id(data["productVersionId"])
@@ -200,20 +267,21 @@ async def create_checkout_session():
             # License ID added by worker.js via webhook
         }
 
-        session = stripe.checkout.Session.create(
-            customer=stripe_customer.id,
-            payment_method_types=["card"],
-            mode="subscription",
-            success_url=request.host_url + "success.html",
-            cancel_url=request.host_url + "cancel.html",
-            line_items=[{"price": price_id, "quantity": 1}],
-            metadata=checkout_metadata,
-            subscription_data={
-                "metadata": subscription_metadata,
-                "description": f"Subscription for {user_info}"  
-
-            }
-        )
+        with tracing.span("stripe.checkout.Session.create"), upstream_call("stripe", ignore=(stripe.InvalidRequestError,)):
+            session = stripe.checkout.Session.create(
+                customer=stripe_customer.id,
+                payment_method_types=["card"],
+                mode="subscription",
+                success_url=request.host_url + "success.html",
+                cancel_url=request.host_url + "cancel.html",
+                line_items=[{"price": price_id, "quantity": 1}],
+                metadata=checkout_metadata,
+                subscription_data={
+                    "metadata": subscription_metadata,
+                    "description": f"Subscription for {user_info}"  
+
+                }
+            )
         
         log_info("=== Checkout Session Created Successfully ===\n")
         return jsonify({"id": session.id})
@@ -222,7 +290,22 @@ async def create_checkout_session():
         return jsonify({"error": str(e)}), 400
 
 
+# Full-text search over doc.html, answered from the in-memory index
+@app.route("/docs/search", methods=["GET"])
+def search_docs():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    limit = request.args.get("limit", type=int)
+    version, results = doc_search.search(query[:200], limit)
+    response = jsonify({"query": query, "results": results})
+    response.headers["Cache-Control"] = "public, max-age=300"
+    response.set_etag(f"{version}-{hashlib.sha1(request.full_path.encode()).hexdigest()[:16]}")
+    return response.make_conditional(request)
+
+
 @app.route("/contact/submit", methods=["POST"])
+@shed_load("smtp")
 def handle_contact_form_python():
     """
     Handle contact form submission with a more Python-like endpoint
@@ -231,7 +314,19 @@ def handle_contact_form_python():
     return process_contact_form(request)
 
 
+@app.route("/contact/stats", methods=["GET"])
+def contact_form_stats():
+    """
+    Counters for accepted and suppressed duplicate contact submissions (admin only)
+    """
+    if not profiling.is_admin(request):
+        abort(404)
+    from contact_form import get_dedupe_stats
+    return jsonify(get_dedupe_stats())
+
+
 @app.route("/newsletter/subscribe", methods=["POST"])
+@shed_load("smtp")
 def handle_newsletter_subscription():
     """
     Handle newsletter subscription
@@ -241,35 +336,24 @@ def handle_newsletter_subscription():
 
 
 if __name__ == "__main__":
-    required_env_vars = [
-        'STRIPE_SECRET_KEY',
-        'STRIPE_PUBLISHABLE_KEY',
-        'CRYPTLEX_TOKEN',
-        'CLOUDFLARE_WORKER_URL',
-        'STRIPE_PRICE_WEB_ID',
-        'STRIPE_PRICE_MOBILE_ID',
-        'STRIPE_PRICE_COMBO_ID',
-        'STRIPE_PRICE_CROSS_ID'
-    ]
-    
-    # Optional environment variables with defaults
-    optional_env_vars = {
-        'EMAIL_USERNAME': 'Email username for contact form',
-        'EMAIL_PASSWORD': 'Email password for contact form',
-        'EMAIL_FROM': 'Sender email for contact form'
-    }
-    
-    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
+    missing_vars = health.missing_env_vars()
     if missing_vars:
         log_error(f"Missing environment variables: {', '.join(missing_vars)}")
         sys.exit(1)
     
     # Log optional variables status
-    for var, description in optional_env_vars.items():
-        if not os.getenv(var):
-            log_info(f"Optional variable {var} not set: {description}")
+    for var, description in health.missing_optional_env_vars():
+        log_info(f"Optional variable {var} not set: {description}")
     
     # Get port from environment or default to 4242 for local dev
     port = int(os.getenv("PORT", 4242))
-    log_info(f"Starting server on 0.0.0.0:{port}...")
-    app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
+
+    # FLASK_DEBUG=1 keeps the Werkzeug reloader for local development
+    if os.getenv("FLASK_DEBUG") == "1":
+        log_info(f"Starting development server on 0.0.0.0:{port}...")
+        health.prober.ensure_started()
+        app.run(host="0.0.0.0", port=port, debug=True)
+    else:
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+        log_info(f"Starting gunicorn on 0.0.0.0:{port} ({os.getenv('WORKER_CLASS', 'gthread')} workers)...")
+        os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "-c", config_path, "server:app"])
\ No newline at end of file
@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+import requests
+from flask import request
+
+logger = logging.getLogger("tracing")
+
+TRACING_CONFIG = {
+    'service_name': os.getenv('TRACE_SERVICE_NAME', 'nimble-server'),
+    # Fraction of requests whose spans are exported; correlation IDs are always on
+    'sample_rate': float(os.getenv('TRACE_SAMPLE_RATE', 0)),
+    # JSON-lines file exporter, one trace per line; empty disables it
+    'file': os.getenv('TRACE_FILE', 'traces.jsonl'),
+    'max_file_bytes': int(os.getenv('TRACE_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+    # OTLP/HTTP JSON collector, e.g. http://localhost:4318/v1/traces
+    'otlp_endpoint': os.getenv('TRACE_OTLP_ENDPOINT'),
+    'otlp_timeout': float(os.getenv('TRACE_OTLP_TIMEOUT', 5)),
+    'queue_size': int(os.getenv('TRACE_QUEUE_SIZE', 1000)),
+    # Outbound calls slower than this are logged even when not sampled
+    'slow_span_ms': float(os.getenv('TRACE_SLOW_SPAN_MS', 2000))
+}
+
+# Incoming X-Request-ID values are only trusted if they look like an ID
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{8,64}$')
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _install_log_record_factory():
+    """
+    Stamp every log record with the current request's correlation ID
+    """
+    previous = logging.getLogRecordFactory()
+    if getattr(previous, '_adds_request_id', False):
+        return
+
+    def factory(*args, **kwargs):
+        record = previous(*args, **kwargs)
+        record.request_id = _request_id.get()
+        return record
+
+    factory._adds_request_id = True
+    logging.setLogRecordFactory(factory)
+
+
+_install_log_record_factory()
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class Span:
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.error = None
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        self.end_ns = self.start_ns + int(self.duration_ms * 1_000_000)
+
+    def to_dict(self):
+        result = {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes
+        }
+        if self.error:
+            result['error'] = self.error
+        return result
+
+
+class Trace:
+    def __init__(self, trace_id, request_id, sampled):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block as a child span of the current request. Outside a request
+    this is a no-op; spans of unsampled requests are only logged when slow.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(trace, name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        if trace.sampled:
+            trace.add(current)
+        if current.duration_ms >= TRACING_CONFIG['slow_span_ms']:
+            logger.warning(f"Slow span {name}: {current.duration_ms:.0f} ms")
+
+
+class SpanExporter:
+    """
+    Exports finished traces from a background thread so requests never wait
+    on the file system or the collector. Drops traces if the queue is full.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._queue = queue.Queue(maxsize=config['queue_size'])
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def enabled(self):
+        return bool(self.config['file'] or self.config['otlp_endpoint'])
+
+    def submit(self, trace):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        # Threads do not survive a fork; each worker starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._queue = queue.Queue(maxsize=self.config['queue_size'])
+        threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.config['file']:
+                    self._write_file(batch)
+                if self.config['otlp_endpoint']:
+                    self._post_otlp(batch)
+            except Exception as e:
+                logger.error(f"Failed to export {len(batch)} traces: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout):
+        """
+        Wait up to timeout seconds for queued traces to be exported
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _write_file(self, batch):
+        path = self.config['file']
+        try:
+            if os.path.getsize(path) > self.config['max_file_bytes']:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        with open(path, "a", encoding="utf-8") as file:
+            for trace in batch:
+                file.write(json.dumps({
+                    'trace_id': trace.trace_id,
+                    'request_id': trace.request_id,
+                    'pid': os.getpid(),
+                    'spans': [s.to_dict() for s in trace.spans]
+                }) + "\n")
+
+    def _post_otlp(self, batch):
+        spans = []
+        for trace in batch:
+            for s in trace.spans:
+                otlp_span = {
+                    'traceId': trace.trace_id,
+                    'spanId': s.span_id,
+                    'name': s.name,
+                    'kind': 2 if s.parent_id is None else 3,
+                    'startTimeUnixNano': str(s.start_ns),
+                    'endTimeUnixNano': str(s.end_ns),
+                    'attributes': [
+                        {'key': key, 'value': {'stringValue': str(value)}}
+                        for key, value in dict(s.attributes, request_id=trace.request_id).items()
+                    ],
+                    'status': {'code': 2, 'message': s.error} if s.error else {'code': 1}
+                }
+                if s.parent_id:
+                    otlp_span['parentSpanId'] = s.parent_id
+                spans.append(otlp_span)
+
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': self.config['service_name']}}
+            ]},
+            'scopeSpans': [{'scope': {'name': 'nimble.tracing'}, 'spans': spans}]
+        }]}
+        response = requests.post(self.config['otlp_endpoint'], json=payload, timeout=self.config['otlp_timeout'])
+        response.raise_for_status()
+
+
+exporter = SpanExporter(TRACING_CONFIG)
+
+
+def _start_request():
+    trace_id = uuid.uuid4().hex
+    incoming = request.headers.get('X-Request-ID', '')
+    request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else trace_id
+    sampled = exporter.enabled() and random.random() < TRACING_CONFIG['sample_rate']
+
+    trace = Trace(trace_id, request_id, sampled)
+    root = Span(trace, f"{request.method} {request.url_rule.rule if request.url_rule else request.path}", None, {
+        'http.method': request.method,
+        'http.target': request.path
+    })
+    request.environ['nimble.trace_tokens'] = (
+        _request_id.set(request_id),
+        _current_trace.set(trace),
+        _current_span.set(root)
+    )
+    request.environ['nimble.trace_root'] = root
+
+
+def _finish_request(response):
+    response.headers['X-Request-ID'] = _request_id.get()
+    root = request.environ.get('nimble.trace_root')
+    if root is not None:
+        root.set_attribute('http.status_code', response.status_code)
+    return response
+
+
+def _end_request(exc):
+    root = request.environ.pop('nimble.trace_root', None)
+    tokens = request.environ.pop('nimble.trace_tokens', None)
+    if root is None:
+        return
+    if exc is not None:
+        root.error = f"{type(exc).__name__}: {str(exc)}"
+    root.end()
+    trace = root.trace
+    if trace.sampled:
+        trace.add(root)
+        exporter.submit(trace)
+
+    request_token, trace_token, span_token = tokens
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+    _request_id.reset(request_token)
+
+
+def init_app(app):
+    """
+    Assign a correlation ID and root span to every request
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)